@@ -21,7 +21,8 @@ drought_request_model = api.model("DroughtRequest", {
     "start_year": fields.Integer(required=True, description="Start year (inclusive)", default=1976),
     "end_year": fields.Integer(required=True, description="End year (inclusive)", default=2005),
     "region_id": fields.Integer(required=True, description="Region ID", default=1030),
-    "threshold": fields.Float(required=False, default=-1.0, description="SPI threshold (default -1.0)")
+    "threshold": fields.Float(required=False, default=-1.0, description="SPI threshold (default -1.0)"),
+    "window": fields.Integer(required=False, default=1, description="Accumulation window in months: 1, 3, 6, 12 or 24 (default 1)")
 })
 
 drought_request_model_2 = api.model("DroughtRequest2", {
@@ -30,15 +31,41 @@ drought_request_model_2 = api.model("DroughtRequest2", {
     "scenario": fields.String(required=True, description="Climate scenario, e.g., rcp45", default="rcp45"),
     "start_year": fields.Integer(required=True, description="Start year (inclusive)", default=1976),
     "end_year": fields.Integer(required=True, description="End year (inclusive)",default=2005),
-    "threshold": fields.Float(required=False, default=-1.0, description="SPI threshold (default -1.0)")
+    "threshold": fields.Float(required=False, default=-1.0, description="SPI threshold (default -1.0)"),
+    "window": fields.Integer(required=False, default=1, description="Accumulation window in months: 1, 3, 6, 12 or 24 (default 1)")
 })
 scenario_model = api.model("ScenarioRequest", {
     "scenario": fields.String(required=True, description="e.g. rcp45")
 })
+point_model = api.model("Point", {
+    "lat": fields.Float(required=True, description="Latitude (EPSG:4326)", default=-33.87),
+    "lon": fields.Float(required=True, description="Longitude (EPSG:4326)", default=151.21)
+})
+batch_query_model = api.model("BatchQuery", {
+    "type": fields.String(required=True, description="Endpoint answering the query: drought-month-count, drought-months-details, drought-event-count, drought-event-stats, drought-months-summary or drought-event-summary", default="drought-month-count"),
+    "index": fields.String(required=True, description="Index name, e.g., spi", default="spi"),
+    "data_source": fields.String(required=True, description="Data source, e.g., CMIP5", default="cmip5"),
+    "scenario": fields.String(required=True, description="Climate scenario, e.g., rcp45", default="rcp45"),
+    "model": fields.String(required=False, description="Model name (region queries only)", default="cccma-canesm2"),
+    "start_year": fields.Integer(required=True, description="Start year (inclusive)", default=1976),
+    "end_year": fields.Integer(required=True, description="End year (inclusive)", default=2005),
+    "region_id": fields.Integer(required=False, description="Region ID (region queries only)", default=1030),
+    "threshold": fields.Float(required=False, default=-1.0, description="SPI threshold (default -1.0)"),
+    "window": fields.Integer(required=False, default=1, description="Accumulation window in months (default 1)")
+})
+batch_request_model = api.model("BatchRequest", {
+    "queries": fields.List(fields.Nested(batch_query_model), required=True, description="Queries of any type, answered in request order")
+})
+region_lookup_model = api.model("RegionLookupRequest", {
+    "points": fields.List(fields.Nested(point_model), required=True, description="Coordinates to resolve to NRM regions")
+})
 
-# create a DroughtDatabase instance to load data from CSV files
-db_loader = DroughtDatabase()
+# create a DroughtDatabase instance to load data from CSV files,
+# served from an in-memory NumPy cube once loaded
+db_loader = DroughtDatabase(use_cube=True)
 db_loader.load_csv_files()
+# summaries of the standard periods and thresholds (only computed when the data changed)
+db_loader.materialise_summaries()
 
 @ns.route("/drought-month-count")
 class DroughtMonthCount(Resource):
@@ -54,7 +81,8 @@ class DroughtMonthCount(Resource):
         end_year = data.get("end_year")
         region_id = data.get("region_id")
         threshold = data.get("threshold", -1.0)
-        count = db_loader.get_drought_month_count_for_region(index, data_source, scenario, model,start_year, end_year, region_id, threshold)
+        window = data.get("window", 1)
+        count = db_loader.get_drought_month_count_for_region(index, data_source, scenario, model,start_year, end_year, region_id, threshold, window)
         return {"success": True, "drought_month_count": count}
 
 @ns.route("/drought-months-details")
@@ -71,7 +99,8 @@ class DroughtMonthsDetails(Resource):
         end_year = data.get("end_year")
         region_id = data.get("region_id")
         threshold = data.get("threshold", -1.0)
-        details = db_loader.get_drought_months_details_for_region(index, data_source, scenario,model, start_year, end_year, region_id, threshold)
+        window = data.get("window", 1)
+        details = db_loader.get_drought_months_details_for_region(index, data_source, scenario,model, start_year, end_year, region_id, threshold, window)
         details_formatted = [f"{y}-{m:02d}" for (y, m) in details]
         return {"success": True, "drought_months_details": details_formatted}
 
@@ -89,9 +118,28 @@ class DroughtEventCount(Resource):
         end_year = data.get("end_year")
         region_id = data.get("region_id")
         threshold = data.get("threshold", -1.0)
-        events = db_loader.get_drought_events_for_region(index, data_source, scenario,model, start_year, end_year, region_id, threshold)
+        window = data.get("window", 1)
+        events = db_loader.get_drought_events_for_region(index, data_source, scenario,model, start_year, end_year, region_id, threshold, window)
         return {"success": True, "drought_events": events}
 
+@ns.route("/drought-event-stats")
+class DroughtEventStats(Resource):
+    @ns.doc("get_drought_event_stats", description="drought events (>=2 months) with duration (months), severity (minus the sum of the index over the event) and peak (lowest index value), plus their summary")
+    @ns.expect(drought_request_model)
+    def post(self):
+        data = request.get_json()
+        index = data.get("index")
+        scenario = data.get("scenario")
+        data_source = data.get("data_source")
+        model = data.get("model")
+        start_year = data.get("start_year")
+        end_year = data.get("end_year")
+        region_id = data.get("region_id")
+        threshold = data.get("threshold", -1.0)
+        window = data.get("window", 1)
+        stats = db_loader.get_drought_event_stats_for_region(index, data_source, scenario, model, start_year, end_year, region_id, threshold, window)
+        return {"success": True, **stats}
+
 @ns.route("/regions")
 class Regions(Resource):
     @ns.doc("get_regions", description="return all the regions（region_id abd region_name）")
@@ -114,8 +162,9 @@ class DroughtMonthsSummary(Resource):
         start_year = data.get("start_year")
         end_year = data.get("end_year")
         threshold = data.get("threshold", -1.0)
+        window = data.get("window", 1)
 
-        summary = db_loader.get_total_drought_months_for_regions(index, data_source, scenario, start_year, end_year, threshold)
+        summary = db_loader.get_total_drought_months_for_regions(index, data_source, scenario, start_year, end_year, threshold, window)
 
         return {"success": True, "drought_summary": summary}
 @ns.route("/drought-event-summary")
@@ -130,10 +179,69 @@ class DroughtEventSummary(Resource):
         start_year = data.get("start_year")
         end_year = data.get("end_year")
         threshold = data.get("threshold", -1.0)
+        window = data.get("window", 1)
 
-        event_summary = db_loader.get_total_drought_events_for_regions(index, data_source, scenario, start_year, end_year, threshold)
+        event_summary = db_loader.get_total_drought_events_for_regions(index, data_source, scenario, start_year, end_year, threshold, window)
         return {"success": True, "drought_summary": event_summary}
 
+# largest number of queries accepted by /batch
+MAX_BATCH_QUERIES = 1000
+
+# response body of every query type of /batch, as returned by the endpoint of the same name
+BATCH_RESPONSES = {
+    "drought-month-count": lambda count: {"drought_month_count": count},
+    "drought-months-details": lambda details: {"drought_months_details": [f"{y}-{m:02d}" for (y, m) in details]},
+    "drought-event-count": lambda events: {"drought_events": events},
+    "drought-event-stats": lambda stats: dict(stats),
+    "drought-months-summary": lambda summary: {"drought_summary": summary},
+    "drought-event-summary": lambda summary: {"drought_summary": summary},
+}
+
+@ns.route("/batch")
+class DroughtBatch(Resource):
+    @ns.doc("run_drought_batch", description="answer a list of queries of the endpoints above in one request; results are returned in request order, each with its own success flag")
+    @ns.expect(batch_request_model)
+    def post(self):
+        data = request.get_json()
+        queries = data.get("queries")
+        if not isinstance(queries, list):
+            return {"success": False, "message": "'queries' must be a list"}, 400
+        if len(queries) > MAX_BATCH_QUERIES:
+            return {"success": False, "message": f"at most {MAX_BATCH_QUERIES} queries per batch"}, 400
+        results = []
+        for query, (ok, value) in zip(queries, db_loader.run_batch_queries(queries)):
+            if ok:
+                results.append({"success": True, **BATCH_RESPONSES[query["type"]](value)})
+            else:
+                results.append({"success": False, "message": value})
+        return {"success": True, "results": results}
+
+@ns.route("/cache-stats")
+class CacheStats(Resource):
+    @ns.doc("get_cache_stats", description="hit/miss/eviction counters and size of the query result cache")
+    def get(self):
+        return {"success": True, "cache": db_loader.get_cache_stats()}
+
+@ns.route("/region-lookup")
+class RegionLookup(Resource):
+    @ns.doc("lookup_regions", description="resolve a batch of coordinates to their NRM region (region_id and region_name, null outside all regions)")
+    @ns.expect(region_lookup_model)
+    def post(self):
+        data = request.get_json()
+        points = data.get("points", [])
+        try:
+            lats = [float(point["lat"]) for point in points]
+            lons = [float(point["lon"]) for point in points]
+        except (KeyError, TypeError, ValueError):
+            return {"success": False, "message": "each point needs numeric 'lat' and 'lon'"}, 400
+        # imported on first use: geopandas, shapely and the NRM shapefile are only needed by this endpoint
+        try:
+            from utils.NRM import lookup_regions  #  utils/NRM.py
+        except ImportError as e:
+            return {"success": False, "message": f"region lookup is unavailable: {e}"}, 503
+        regions = lookup_regions(lats, lons)
+        return {"success": True, "regions": regions}
+
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=9901, debug=True)
\ No newline at end of file
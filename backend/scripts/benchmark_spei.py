@@ -0,0 +1,95 @@
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from backend.services.SPEI import compute_spei_for_region, compute_spei_numpy
+
+# -----------------------------------------------------------------------------
+# Benchmark of the SPEI engines on a synthetic monthly water balance:
+#   fisk: legacy per-region Fisk MLE fits of the whole series (compute_spei_for_region)
+#   pwm:  batched PWM log-logistic fit per calendar month on the calibration period (compute_spei_numpy)
+#
+# Run from the repository root:
+#   python -m backend.scripts.benchmark_spei --regions 58 --windows 1 3 6 12 24
+# -----------------------------------------------------------------------------
+
+CAL_START, CAL_END = "1976-01-01", "2005-12-31"
+
+
+def make_water_balance(n_regions, start="1950-01-01", end="2100-12-01", seed=0):
+    """
+    Synthetic monthly water balance (region x time) in mm/month with a seasonal cycle,
+    region-specific skewness and a drying trend.
+    """
+    rng = np.random.default_rng(seed)
+    time_index = pd.date_range(start, end, freq="MS")
+    months = time_index.month.values
+    years = (time_index.year.values - time_index.year.values[0]) / 100.0
+
+    seasonal = 30 * np.cos(2 * np.pi * (months - 1) / 12)
+    skew = rng.uniform(0.5, 2.0, size=(n_regions, 1))
+    noise = rng.gamma(shape=skew, scale=20.0, size=(n_regions, time_index.size)) - 20.0 * skew
+    wb = seasonal + noise - 10 * years
+
+    return xr.DataArray(
+        wb,
+        coords={"region": np.arange(1, n_regions + 1), "time": time_index},
+        dims=("region", "time"),
+        name="wb",
+    )
+
+
+def run_fisk(wb, windows):
+    frames = [
+        compute_spei_for_region(
+            wb.sel(region=region_id), "BENCH", "bench", "synthetic", int(region_id), str(region_id),
+            CAL_START, CAL_END, freq=None, windows=windows, engine="fisk",
+        )
+        for region_id in wb.region.values
+    ]
+    return pd.concat(frames, ignore_index=True)
+
+
+def run_pwm(wb, windows):
+    return compute_spei_numpy(wb, CAL_START, CAL_END, windows)
+
+
+def time_call(func, *args, repeat=3):
+    best = np.inf
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the legacy Fisk and the batched PWM SPEI engines.")
+    parser.add_argument("--regions", type=int, default=58)
+    parser.add_argument("--windows", type=int, nargs="+", default=[1, 3, 6, 12, 24])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    wb = make_water_balance(args.regions)
+    print(f"⚙️ {args.regions} regions x {wb.sizes['time']} months, windows {args.windows}")
+
+    fisk_seconds, _ = time_call(run_fisk, wb, args.windows, repeat=args.repeat)
+    pwm_seconds, spei = time_call(run_pwm, wb, args.windows, repeat=args.repeat)
+    _, spei_again = time_call(run_pwm, wb, args.windows, repeat=1)
+
+    # calibration-period SPEI should be close to standard normal for every region and window
+    calibration = spei.sel(time=slice(CAL_START, CAL_END))
+    mean = float(np.abs(calibration.mean("time")).max())
+    std = float(np.abs(calibration.std("time") - 1).max())
+
+    print(f"[⏱️] fisk (per region): {fisk_seconds:.3f}s")
+    print(f"[⏱️] pwm  (batched):    {pwm_seconds:.3f}s  ({fisk_seconds / pwm_seconds:.0f}x faster)")
+    print(f"[📊] pwm calibration period: max |mean| {mean:.3f}, max |std - 1| {std:.3f}")
+    print(f"[✅] pwm deterministic: {bool(spei.equals(spei_again))}")
+
+
+if __name__ == "__main__":
+    main()
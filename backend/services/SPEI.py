@@ -1,23 +1,59 @@
+import os
 import xarray as xr
 import pandas as pd
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 
+from scipy.special import ndtri
 from scipy.stats import fisk, norm
 
-from utils.readNcFiles import load_data
-from utils.NRM import get_shapefile_path, extract_regions_from_shapefile
+try:
+    from backend.utils.readNcFiles import load_data, load_monthly_data, sum_to_monthly, get_source_fingerprint
+    from backend.utils.zarrStore import combine_fingerprints
+    from backend.utils.accumulation import (
+        DEFAULT_WINDOWS, WINDOW_DIM, rolling_window_means, window_column_name, merge_window_frames
+    )
+    from backend.utils.parallel import map_tasks
+    from backend.utils.paramStore import get_param_path, compute_series_key, load_or_fit_window_params
+    from backend.utils.NRM import (
+        get_shapefile_path, load_region_label_grid, get_labelled_window, aggregate_region_means, region_means_to_dataframe
+    )
+except ModuleNotFoundError as e:
+    if e.name != "backend":
+        raise
+    # run from the backend folder (like app.py), where utils is a top-level package
+    from utils.readNcFiles import load_data, load_monthly_data, sum_to_monthly, get_source_fingerprint
+    from utils.zarrStore import combine_fingerprints
+    from utils.accumulation import (
+        DEFAULT_WINDOWS, WINDOW_DIM, rolling_window_means, window_column_name, merge_window_frames
+    )
+    from utils.parallel import map_tasks
+    from utils.paramStore import get_param_path, compute_series_key, load_or_fit_window_params
+    from utils.NRM import (
+        get_shapefile_path, load_region_label_grid, get_labelled_window, aggregate_region_means, region_means_to_dataframe
+    )
+
+# "pwm": three-parameter log-logistic fitted per calendar month on the calibration period by unbiased
+#        probability-weighted moments (Vicente-Serrano et al., 2010), all regions at once
+# "fisk": legacy two-sided Fisk maximum likelihood fit of the whole series, one region at a time
+SPEI_ENGINES = ("pwm", "fisk")
+
+# Names of the log-logistic parameters, each stored as a (series, 12 calendar months) array
+LOGLOGISTIC_PARAMS = ("xi", "alpha", "k")
+
+# Same bound as the SPI: the largest |index| a float64 probability can be mapped to
+SPEI_LIMIT = 8.21
 
 
 def remove_duplicate_times(ds: xr.Dataset) -> xr.Dataset:
     """
-    We use groupby("time").first() to eliminate duplicate time points, keeping only the first data point in each time.
-    No sortby("time") is used, reducing the memory footprint significantly.
+    Eliminate duplicate time points, keeping only the first data point in each time.
+    Duplicates are found on the time index alone, so no data is read or regrouped.
     """
-    # It is recommended to make a certain chunk of ds first, so that groupby aggregation can be processed in chunks, avoiding reading into memory at once
-    ds = ds.chunk({"time": 10, "lat": 100, "lon": 100})
-    ds_unique = ds.groupby("time").first()
-    return ds_unique
+    duplicated = ds.get_index("time").duplicated()
+    if not duplicated.any():
+        return ds
+    return ds.isel(time=~duplicated)
 
 
 def convert_cftime_to_datetime64(ds: xr.Dataset) -> xr.Dataset:
@@ -61,11 +97,11 @@ def extract_precipitation_evaporation(ds_pr: xr.Dataset, ds_evap: xr.Dataset) ->
     return wb
 
 
-def compute_spei_loglogistic(wb_array: np.ndarray) -> np.ndarray:
+def fit_spei_loglogistic(wb_array: np.ndarray) -> dict:
     """
-    A log-log (Fisk) distribution was fitted to the water balance data with positive and negative values separately to obtain the SPEI.
+    Fit the log-log (Fisk) distributions of the positive and the negative water balance values separately.
     wb_array: 1D numpy array (can contain positive and negative values)
-    Returns the SPEI normalized value of the same length.
+    Returns {"pos": (c, loc, scale), "neg": (c, loc, scale)} as numpy arrays.
     """
     wb = wb_array.flatten()
     pos_mask = wb >= 0
@@ -74,12 +110,25 @@ def compute_spei_loglogistic(wb_array: np.ndarray) -> np.ndarray:
     if np.sum(pos_mask) < 5 or np.sum(neg_mask) < 5:
         raise ValueError("The sample size for positive or negative intervals was too small to fit the log-log distributions separately.")
 
-    pos_params = fisk.fit(wb[pos_mask], floc=0)
-    F_pos = fisk.cdf(wb[pos_mask], *pos_params)
+    return {
+        "pos": np.asarray(fisk.fit(wb[pos_mask], floc=0)),
+        "neg": np.asarray(fisk.fit(-wb[neg_mask], floc=0)),
+    }
+
+
+def apply_spei_loglogistic(wb_array: np.ndarray, params: dict) -> np.ndarray:
+    """
+    Map the water balance to SPEI with the distributions from fit_spei_loglogistic.
+    Returns the SPEI normalized value of the same length.
+    """
+    wb = wb_array.flatten()
+    pos_mask = wb >= 0
+    neg_mask = wb < 0
+
+    F_pos = fisk.cdf(wb[pos_mask], *params["pos"])
     spei_pos = norm.ppf(F_pos)
 
-    neg_params = fisk.fit(-wb[neg_mask], floc=0)
-    F_neg = 1.0 - fisk.cdf(-wb[neg_mask], *neg_params)
+    F_neg = 1.0 - fisk.cdf(-wb[neg_mask], *params["neg"])
     spei_neg = norm.ppf(F_neg)
 
     spei = np.empty_like(wb)
@@ -89,6 +138,191 @@ def compute_spei_loglogistic(wb_array: np.ndarray) -> np.ndarray:
     return spei
 
 
+def build_monthly_water_balance_regions(
+    ds_pr: xr.Dataset,
+    ds_evap: xr.Dataset,
+    label_grid: xr.Dataset,
+    variable: str = "pr",
+) -> xr.DataArray:
+    """
+    Fused, lazily evaluated water balance stage: align the daily pr and evspsbl fields on their common
+    days, compute wb = pr - evspsbl in mm/day, reduce it to the region means and sum them to monthly totals.
+    Everything stays in one dask graph, so the daily water balance field is only ever streamed chunk by chunk
+    and nothing is computed until the caller asks for the (region, time) result.
+
+    Parameters:
+        ds_pr: xarray.Dataset, daily data containing `variable` in kg/m²/s
+        ds_evap: xarray.Dataset, daily data containing "evspsbl" in kg/m²/s
+        label_grid: xarray.Dataset, region label grid of the data's lat/lon (see NRM.load_region_label_grid)
+        variable: str, precipitation variable name
+
+    Returns:
+        xarray.DataArray (region, time), lazy monthly water balance in mm/month with a "region_name" coordinate
+    """
+    window = get_labelled_window(label_grid)
+    pr = ds_pr[variable].isel(window)
+    evspsbl = ds_evap["evspsbl"].isel(window)
+
+    # both variables come from the same model run, but sub-daily time stamps may differ between files
+    pr = pr.assign_coords(time=pr.get_index("time").floor("D"))
+    evspsbl = evspsbl.assign_coords(time=evspsbl.get_index("time").floor("D"))
+    pr, evspsbl = xr.align(pr, evspsbl, join="inner")
+
+    # reducing to regions first shrinks every daily chunk to (time, region) before the monthly sum;
+    # model output has no missing land cells, so this equals summing the grid first
+    wb = (pr - evspsbl) * 86400
+    wb_daily_regions = aggregate_region_means(wb, label_grid.isel(window))
+    wb_regions = sum_to_monthly(wb_daily_regions)
+    wb_regions.name = "wb"
+    wb_regions.attrs["units"] = "mm/month"
+    return wb_regions
+
+
+def compute_spei_loglogistic(wb_array: np.ndarray) -> np.ndarray:
+    """
+    A log-log (Fisk) distribution was fitted to the water balance data with positive and negative values separately to obtain the SPEI.
+    wb_array: 1D numpy array (can contain positive and negative values)
+    Returns the SPEI normalized value of the same length.
+    """
+    return apply_spei_loglogistic(wb_array, fit_spei_loglogistic(wb_array))
+
+
+def fit_loglogistic_pwm(samples: np.ndarray) -> tuple:
+    """
+    Fit a three-parameter log-logistic distribution to every series of a stacked array at once from
+    unbiased probability-weighted moments. The distribution uses Hosking's generalized logistic
+    parametrisation (as the reference SPEI implementation does), which also covers negatively skewed
+    water balance that the original Vicente-Serrano et al. (2010) parameters cannot represent.
+
+    Parameters:
+        samples: np.ndarray, (..., n) calibration samples, NaN for missing values
+
+    Returns:
+        (xi, alpha, k): np.ndarrays of shape (...), location, scale and shape
+    """
+    ordered = np.sort(samples, axis=-1)  # NaN sorts last, so valid values keep ranks 1..n
+    n = (~np.isnan(samples)).sum(axis=-1, keepdims=True).astype(np.float64)
+    rank = np.arange(1, samples.shape[-1] + 1, dtype=np.float64)
+    values = np.where(np.isnan(ordered), 0.0, ordered)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # unbiased PWMs b_r = E[x F^r] and the L-moments derived from them
+        b0 = values.sum(axis=-1) / n[..., 0]
+        b1 = (values * (rank - 1) / (n - 1)).sum(axis=-1) / n[..., 0]
+        b2 = (values * (rank - 1) * (rank - 2) / ((n - 1) * (n - 2))).sum(axis=-1) / n[..., 0]
+        l1 = b0
+        l2 = 2 * b1 - b0
+        t3 = (6 * b2 - 6 * b1 + b0) / l2
+
+        k = -t3
+        # alpha and xi tend to l2 and l1 as k -> 0
+        k_pi = np.where(np.abs(k) < 1e-6, 1e-6, k) * np.pi
+        alpha = np.where(np.abs(k) < 1e-6, l2, l2 * np.sin(k_pi) / k_pi)
+        xi = np.where(np.abs(k) < 1e-6, l1, l1 - alpha * (1 / k - np.pi / np.sin(k_pi)))
+
+    return xi, alpha, k
+
+
+def loglogistic_to_spei(values: np.ndarray, xi: np.ndarray, alpha: np.ndarray, k: np.ndarray) -> np.ndarray:
+    """
+    Map the water balance to SPEI through the log-logistic CDF F(x) = 1 / (1 + exp(-y)),
+    y = -log(1 - k (x - xi) / alpha) / k, and the standard normal quantile function.
+    Values beyond the support bound get F = 0 or 1; results are clipped to ±SPEI_LIMIT.
+    """
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        z = (values - xi) / alpha
+        small_k = np.abs(k) < 1e-6
+        arg = 1 - k * z
+        y = np.where(small_k, z, -np.log(np.where(arg > 0, arg, np.nan)) / np.where(small_k, 1.0, k))
+        # outside the support (arg <= 0) the value lies above the upper bound (k > 0) or below the lower bound (k < 0)
+        y = np.where(~small_k & (arg <= 0), np.where(k > 0, np.inf, -np.inf), y)
+        probs = 1 / (1 + np.exp(-y))
+        spei = np.clip(ndtri(probs), -SPEI_LIMIT, SPEI_LIMIT)
+    return np.where(np.isnan(values) | np.isnan(alpha), np.nan, spei)
+
+
+def fit_spei_params(wb: np.ndarray, months: np.ndarray, calibration: np.ndarray) -> dict:
+    """
+    Fit the log-logistic distribution of every series and calendar month on the calibration years.
+
+    Parameters:
+        wb: np.ndarray, (series, time) monthly water balance
+        months: np.ndarray, (time,) calendar month (1-12) of each time step
+        calibration: np.ndarray, (time,) boolean mask of the calibration period
+
+    Returns:
+        dict: {"xi", "alpha", "k"}, each np.ndarray of shape (series, 12)
+    """
+    params = {name: np.full((wb.shape[0], 12), np.nan) for name in LOGLOGISTIC_PARAMS}
+    for month in range(1, 13):
+        in_month = months == month
+        if not in_month.any():
+            continue
+        fitted = fit_loglogistic_pwm(wb[:, in_month & calibration])
+        for name, values in zip(LOGLOGISTIC_PARAMS, fitted):
+            params[name][:, month - 1] = values
+    return params
+
+
+def apply_spei_params(wb: np.ndarray, months: np.ndarray, params: dict) -> np.ndarray:
+    """
+    Map monthly water balance series to SPEI with parameters from fit_spei_params.
+
+    Returns:
+        np.ndarray, (series, time) SPEI values
+    """
+    index = months - 1
+    return loglogistic_to_spei(wb, *(params[name][:, index] for name in LOGLOGISTIC_PARAMS))
+
+
+def compute_spei_numpy(
+    wb: xr.DataArray,
+    cal_start: str,
+    cal_end: str,
+    windows=DEFAULT_WINDOWS,
+    param_path: str = None,
+    refit: bool = False,
+) -> xr.DataArray:
+    """
+    Compute SPEI for every series of a monthly water balance DataArray (any dims besides time)
+    with the batched PWM log-logistic fit. All windows share one cumulative sum of the series.
+    With a param_path, fitted parameters are reused from disk (see paramStore); refit=True fits again.
+
+    Returns:
+        xarray.DataArray of SPEI with dims ("window", *wb dims)
+    """
+    wb = wb.transpose("time", ...)
+
+    calibration = np.zeros(wb.sizes["time"], dtype=bool)
+    calibration[wb.get_index("time").slice_indexer(cal_start, cal_end)] = True
+    months = wb.time.dt.month.values
+
+    windows = list(windows)
+    balances = rolling_window_means(wb.values.reshape(wb.sizes["time"], -1).T, windows)
+    params = load_or_fit_window_params(
+        param_path,
+        compute_series_key(*(wb[dim].values for dim in wb.dims if dim != "time")),
+        windows,
+        LOGLOGISTIC_PARAMS,
+        lambda window: fit_spei_params(balances[window], months, calibration),
+        refit=refit,
+        cal_start=cal_start, cal_end=cal_end, dist="loglogistic-pwm",
+    )
+    spei = [apply_spei_params(balances[window], months, params[window]).T.reshape(wb.shape) for window in windows]
+
+    return xr.DataArray(
+        np.stack(spei), coords={**wb.coords, WINDOW_DIM: windows}, dims=(WINDOW_DIM, *wb.dims), name="SPEI"
+    )
+
+
+def check_spei_engine(engine: str):
+    """
+    Raise a ValueError for an unknown SPEI engine (see SPEI_ENGINES).
+    """
+    if engine not in SPEI_ENGINES:
+        raise ValueError(f"Unknown SPEI engine '{engine}', expected one of {SPEI_ENGINES}")
+
+
 def compute_spei_for_region(
     wb_region: xr.DataArray,
     model_family: str,
@@ -98,13 +332,26 @@ def compute_spei_for_region(
     region_name: str,
     cal_start: str = "1976-01-01",
     cal_end: str = "2005-12-31",
+    freq: str = "MS",
+    windows=DEFAULT_WINDOWS,
+    param_path: str = None,
+    refit: bool = False,
+    engine: str = "pwm",
 ) -> pd.DataFrame:
     """
     The SPEI is calculated for the wb data in a specific region and returns pd.DataFrame.
+    Daily wb is summed to monthly totals at `freq`; pass freq=None if wb_region already holds monthly totals.
+    Each accumulation window is fitted on the rolling means of the monthly series and stored as its own
+    column (SPEI, SPEI_3, SPEI_6, ...); months before a window is complete stay empty.
+    With a param_path, the fitted distributions are reused from disk (see paramStore) and only missing
+    windows are fitted; refit=True fits again and overwrites them.
+    engine selects the distribution fit, see SPEI_ENGINES.
     """
+    check_spei_engine(engine)
     try:
         wb_region = wb_region.sortby("time")
-        wb_region = wb_region.resample(time="MS").sum()
+        if freq is not None:
+            wb_region = wb_region.resample(time=freq).sum()
 
         # check the number of time points
         if wb_region.time.size < 3:
@@ -113,12 +360,34 @@ def compute_spei_for_region(
                 columns=["time","SPEI","region_id","region_name","model_family","scenario","model_name"]
             )
 
-        wb_1d = wb_region.mean(dim=["lat","lon"], skipna=True)
-
-        # compute SPEI
-        spei_values = compute_spei_loglogistic(wb_1d.values)
-        spei_da = xr.DataArray(spei_values, coords=[wb_1d.time], dims=["time"])
-        df = spei_da.to_dataframe(name="SPEI").reset_index()
+        # region means from NRM.aggregate_region_means are already 1D
+        if "lat" in wb_region.dims:
+            wb_1d = wb_region.mean(dim=["lat","lon"], skipna=True)
+        else:
+            wb_1d = wb_region
+
+        # compute SPEI for every window from one set of rolling sums
+        df = pd.DataFrame({"time": wb_1d.time.values})
+        if engine == "pwm":
+            spei = compute_spei_numpy(wb_1d, cal_start, cal_end, windows, param_path, refit)
+            for window in spei[WINDOW_DIM].values:
+                df[window_column_name("SPEI", int(window))] = spei.sel({WINDOW_DIM: window}).values
+        else:
+            balances = rolling_window_means(wb_1d.values, windows)
+            params = load_or_fit_window_params(
+                param_path,
+                compute_series_key([region_id]),
+                list(windows),
+                ("pos", "neg"),
+                lambda window: fit_spei_loglogistic(balances[window][~np.isnan(balances[window])]),
+                refit=refit,
+                dist="fisk", region_id=region_id,
+            )
+            for window, wb_window in balances.items():
+                valid = ~np.isnan(wb_window)
+                spei_values = np.full(wb_window.shape, np.nan)
+                spei_values[valid] = apply_spei_loglogistic(wb_window[valid], params[window])
+                df[window_column_name("SPEI", window)] = spei_values
 
         # Formatting time
         df["time"] = pd.to_datetime(df["time"], errors="coerce").dt.strftime("%Y-%m")
@@ -146,48 +415,97 @@ def export_all_regions_spei_to_csv(
     variable: str,
     cal_start: str,
     cal_end: str,
+    freq: str = "MS",
+    windows=DEFAULT_WINDOWS,
+    output_dir: str = None,
+    cache_params: bool = True,
+    refit: bool = False,
+    engine: str = "pwm",
+    executor: str = "process",
+    max_workers: int = None,
+    memory_limit=None,
+    source_fingerprint: str = None,
 ):
     """
-    SPEI is computed for all regions in parallel and the summary CSV is derived.
+    SPEI is computed for all regions and the summary CSV is derived.
+    With the "pwm" engine all regions are fitted in one NumPy batch; the legacy "fisk" engine
+    fits every region separately on the selected execution backend (see parallel.EXECUTION_BACKENDS):
+    executor="serial", "process" (default, max_workers processes) or "dask" (local cluster with
+    max_workers workers and memory_limit per worker). Rows are always written in region order.
+    The CSV holds one column per accumulation window: SPEI (1 month), SPEI_3, SPEI_6, ...
+    It is written to output_dir, or to the current directory if output_dir is None.
+    With cache_params, the fitted distributions are stored in backend/data/index_params
+    and reused by later runs over the same series and source data (source_fingerprint, see
+    readNcFiles.get_source_fingerprint); refit=True fits them again.
     """
-    all_spei_dfs = []
-    print(f" Starting SPEI computation for all regions (parallel)... [model={model_name}]")
+    check_spei_engine(engine)
+    print(f" Starting SPEI computation for all regions... [model={model_name}, engine={engine}]")
 
-    for region_id, da in region_dict.items():
-        da.attrs.setdefault("units", "mm/day")
+    # daily water balance is resampled with freq, monthly input (freq=None) holds the mm/month totals
+    units = "mm/day" if freq else "mm/month"
+    for region_id, info in region_dict.items():
+        info["data"].attrs.setdefault("units", units)
 
     region_dict = {
-        region_id: da for region_id, da in region_dict.items()
-        if da.sizes.get("lat", 0) > 0 and da.sizes.get("lon", 0) > 0
+        region_id: info for region_id, info in region_dict.items()
+        if int(info["data"].count()) > 0
     }
     print(f" Filtered and retained {len(region_dict)} non-empty regions.")
 
-    def compute_single(region_id, data_array):
-        region_name = f"Region_{region_id}"
-        print(f" [START] {region_id} - {region_name}")
-        return compute_spei_for_region(
-            wb_region=data_array,
-            model_family=model_family,
-            scenario=scenario,
-            model_name=model_name,
-            region_id=region_id,
-            region_name=region_name,
-            cal_start=cal_start,
-            cal_end=cal_end,
+    if engine == "pwm":
+        param_path = None
+        if cache_params:
+            param_path = get_param_path(
+                "spei", model_family, scenario, model_name, variable,
+                cal_start=cal_start, cal_end=cal_end, engine=engine, source="daily" if freq else "monthly",
+                source_fingerprint=source_fingerprint,
+            )
+        all_spei_df = compute_all_regions_spei_pwm(
+            region_dict, model_family, scenario, model_name, cal_start, cal_end, freq, windows, param_path, refit
+        )
+        write_spei_csv(all_spei_df, model_family, scenario, model_name, variable, output_dir, len(region_dict))
+        return
+
+    def get_region_param_path(region_id, data):
+        if not cache_params:
+            return None
+        # the log-logistic fit uses the whole series, so its period is part of the fit settings
+        time_index = data.get_index("time")
+        return get_param_path(
+            "spei", model_family, scenario, model_name, variable, region_id=region_id,
+            cal_start=cal_start, cal_end=cal_end, engine="fisk", source="daily" if freq else "monthly",
+            period=(str(time_index[0]), str(time_index[-1])), source_fingerprint=source_fingerprint,
         )
 
-    with ThreadPoolExecutor(max_workers=1) as executor:
-        futures = {
-            executor.submit(compute_single, region_id, data_array): region_id
-            for region_id, data_array in region_dict.items()
+    compute_single = partial(
+        compute_spei_for_region,
+        model_family=model_family,
+        scenario=scenario,
+        model_name=model_name,
+        cal_start=cal_start,
+        cal_end=cal_end,
+        freq=freq,
+        windows=windows,
+        refit=refit,
+        engine=engine,
+    )
+    tasks = [
+        {
+            "wb_region": info["data"],
+            "region_id": region_id,
+            "region_name": info["name"],
+            "param_path": get_region_param_path(region_id, info["data"]),
         }
-        for future in as_completed(futures):
-            try:
-                result = future.result()
-                all_spei_dfs.append(result)
-            except Exception as e:
-                rid = futures[future]
-                print(f" Exception in region {rid}: {e}")
+        for region_id, info in region_dict.items()
+    ]
+
+    def report_failure(task, error):
+        print(f" Exception in region {task['region_id']}: {error}")
+        return None
+
+    print(f" Running {len(tasks)} regions on the '{executor}' backend...")
+    results = map_tasks(compute_single, tasks, executor, max_workers, memory_limit, on_error=report_failure)
+    all_spei_dfs = [result for result in results if result is not None]
 
     if all_spei_dfs:
         all_spei_df = pd.concat(all_spei_dfs, ignore_index=True)
@@ -196,10 +514,60 @@ def export_all_regions_spei_to_csv(
             columns=["time","SPEI","region_id","region_name","model_family","scenario","model_name"]
         )
 
+    write_spei_csv(all_spei_df, model_family, scenario, model_name, variable, output_dir, len(region_dict))
+
+
+def compute_all_regions_spei_pwm(
+    region_dict: dict,
+    model_family: str,
+    scenario: str,
+    model_name: str,
+    cal_start: str,
+    cal_end: str,
+    freq: str = "MS",
+    windows=DEFAULT_WINDOWS,
+    param_path: str = None,
+    refit: bool = False,
+) -> pd.DataFrame:
+    """
+    Stack the water balance of all regions into one (region, time) array and compute SPEI
+    for every region and window with a single batched PWM log-logistic fit.
+    """
+    region_ids = list(region_dict)
+    series = []
+    for region_id in region_ids:
+        data = region_dict[region_id]["data"]
+        if "lat" in data.dims:
+            data = data.mean(dim=["lat", "lon"], skipna=True)
+        series.append(data.drop_vars(["region", "region_name"], errors="ignore"))
+
+    wb_regions = xr.concat(series, dim="region").sortby("time")
+    wb_regions = wb_regions.assign_coords(
+        region=region_ids, region_name=("region", [region_dict[region_id]["name"] for region_id in region_ids])
+    )
+    if freq is not None:
+        wb_regions = wb_regions.resample(time=freq).sum()
+
+    spei = compute_spei_numpy(wb_regions, cal_start, cal_end, windows, param_path, refit)
+    return merge_window_frames({
+        int(window): region_means_to_dataframe(
+            spei.sel({WINDOW_DIM: window}, drop=True), "SPEI",
+            model_family=model_family, scenario=scenario, model_name=model_name
+        )
+        for window in spei[WINDOW_DIM].values
+    }, "SPEI")
+
+
+def write_spei_csv(all_spei_df, model_family, scenario, model_name, variable, output_dir=None, n_regions=None):
+    """
+    Write the all-region SPEI table to all_regions_spei_<family>_<scenario>_<variable>_<model>.csv.
+    """
     output_path = f"all_regions_spei_{model_family}_{scenario}_{variable}_{model_name}.csv"
+    if output_dir is not None:
+        output_path = os.path.join(output_dir, output_path)
     all_spei_df.to_csv(output_path, index=False)
     print(f" All region SPEI results saved to: {output_path}")
-    print(f" Computed SPEI for {all_spei_df['region_id'].nunique()} out of {len(region_dict)} regions.")
+    print(f" Computed SPEI for {all_spei_df['region_id'].nunique()} out of {n_regions} regions.")
 
 
 def compute_spei(
@@ -209,36 +577,59 @@ def compute_spei(
     variable: str,
     cal_start: str = "1976-01-01",
     cal_end: str = "2005-12-31",
+    use_monthly: bool = True,
+    windows=DEFAULT_WINDOWS,
+    output_dir: str = None,
+    cache_params: bool = True,
+    refit: bool = False,
+    engine: str = "pwm",
+    executor: str = "process",
+    max_workers: int = None,
+    memory_limit=None,
 ):
     """
+    Compute SPEI for all NRM regions of one model/scenario and export it to CSV.
+    With use_monthly=True the persisted monthly totals of pr and evspsbl are used
+    (see readNcFiles.load_monthly_data) instead of resampling the daily data on every run.
+    windows lists the accumulation windows in months, written as SPEI, SPEI_3, SPEI_6, ...
+    The CSV is written to output_dir (default: the current directory).
+    cache_params reuses the distributions fitted by earlier runs (backend/data/index_params), refit forces new fits.
+    engine selects the distribution fit: "pwm" (batched, calibration period only) or the legacy "fisk".
+    executor, max_workers and memory_limit configure the per-region stage of the "fisk" engine.
     """
     print(f" Loading {model_family} data for model={model_name}, scenario={scenario}...")
 
-    # 读入 historical + scenario
-    ds_var_hist = load_data(model_family, "historical", variable, model_name)
-    ds_var_fut = load_data(model_family, scenario, variable, model_name)
-
-    ds_evap_hist = load_data(model_family, "historical", "evspsbl", model_name)
-    ds_evap_fut = load_data(model_family, scenario, "evspsbl", model_name)
-
-    print("Starting to merge past and future data...")
-    ds_var = xr.concat([ds_var_hist, ds_var_fut], dim="time")
-    ds_evap = xr.concat([ds_evap_hist, ds_evap_fut], dim="time")
-    print("Merge data successfully.")
-    ds_var = remove_duplicate_times(ds_var)
-    ds_evap = remove_duplicate_times(ds_evap)
-
-    # ========================================================
-
-    ds_var = convert_cftime_to_datetime64(ds_var)
-    ds_evap = convert_cftime_to_datetime64(ds_evap)
+    shapefile_path = get_shapefile_path()
+    if use_monthly:
+        ds_var = load_monthly_data(model_family, scenario, variable, model_name)
+        ds_evap = load_monthly_data(model_family, scenario, "evspsbl", model_name)
+        ds_var = convert_cftime_to_datetime64(ds_var)
+        ds_evap = convert_cftime_to_datetime64(ds_evap)
+
+        print(" Computing monthly water balance (pr - evspsbl)...")
+        wb = ds_var[variable] - ds_evap["evspsbl"]
+        wb.name = "wb"
+        wb.attrs["units"] = "mm/month"
+
+        print("🗺️  Aggregating water balance by NRM regions...")
+        label_grid = load_region_label_grid(shapefile_path, wb.lat.values, wb.lon.values)
+        wb_regions = aggregate_region_means(wb, label_grid).compute()
+    else:
+        # load_data reads historical + scenario once per variable and trims their overlap
+        ds_var = load_data(model_family, scenario, variable, model_name, lazy=True)
+        ds_evap = load_data(model_family, scenario, "evspsbl", model_name, lazy=True)
 
-    print(" Computing water balance (pr - evspsbl)...")
-    wb = extract_precipitation_evaporation(ds_var, ds_evap)
+        print("🗺️  Computing monthly water balance (pr - evspsbl) by NRM regions in one pass...")
+        label_grid = load_region_label_grid(shapefile_path, ds_var.lat.values, ds_var.lon.values)
+        wb_regions = build_monthly_water_balance_regions(ds_var, ds_evap, label_grid, variable).compute()
+        wb_regions = convert_cftime_to_datetime64(wb_regions)
 
-    print("🗺️  Splitting by NRM regions...")
-    shapefile_path = get_shapefile_path()
-    region_dict = extract_regions_from_shapefile(shapefile_path, wb)
+    # both paths yield monthly totals, so no further resampling is needed
+    freq = None
+    region_dict = {
+        int(region_id): {"name": str(region_name), "data": wb_regions.sel(region=region_id)}
+        for region_id, region_name in zip(wb_regions.region.values, wb_regions.region_name.values)
+    }
 
     export_all_regions_spei_to_csv(
         region_dict,
@@ -248,6 +639,20 @@ def compute_spei(
         variable=variable,
         cal_start=cal_start,
         cal_end=cal_end,
+        freq=freq,
+        windows=windows,
+        output_dir=output_dir,
+        cache_params=cache_params,
+        refit=refit,
+        engine=engine,
+        executor=executor,
+        max_workers=max_workers,
+        memory_limit=memory_limit,
+        # the fitted parameters are only reused for the same pr and evspsbl source files
+        source_fingerprint=combine_fingerprints(
+            get_source_fingerprint(model_family, scenario, variable, model_name),
+            get_source_fingerprint(model_family, scenario, "evspsbl", model_name),
+        ),
     )
 
 
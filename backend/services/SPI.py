@@ -1,8 +1,39 @@
+import os
+import numpy as np
 import xarray as xr
 import pandas as pd
+from scipy.special import gammainc, ndtri
 from xclim.indices import standardized_precipitation_index
-from backend.utils.readNcFiles import load_data
-from backend.utils.NRM import get_shapefile_path, extract_regions_from_shapefile
+try:
+    from backend.utils.readNcFiles import load_data, load_monthly_data, sum_to_monthly, get_source_fingerprint
+    from backend.utils.accumulation import DEFAULT_WINDOWS, WINDOW_DIM, rolling_window_means, merge_window_frames
+    from backend.utils.paramStore import get_param_path, compute_series_key, load_or_fit_window_params
+    from backend.utils.NRM import (
+        get_shapefile_path, load_region_label_grid, get_labelled_window, aggregate_region_means, region_means_to_dataframe,
+        weighted_region_mean
+    )
+except ModuleNotFoundError as e:
+    if e.name != "backend":
+        raise
+    # run from the backend folder (like app.py), where utils is a top-level package
+    from utils.readNcFiles import load_data, load_monthly_data, sum_to_monthly, get_source_fingerprint
+    from utils.accumulation import DEFAULT_WINDOWS, WINDOW_DIM, rolling_window_means, merge_window_frames
+    from utils.paramStore import get_param_path, compute_series_key, load_or_fit_window_params
+    from utils.NRM import (
+        get_shapefile_path, load_region_label_grid, get_labelled_window, aggregate_region_means, region_means_to_dataframe,
+        weighted_region_mean
+    )
+
+# "xclim": xclim's standardized_precipitation_index, one fit per grid cell and calendar month
+# "numpy": the batched zero-inflated gamma fit below, all series and calendar months at once
+SPI_ENGINES = ("xclim", "numpy")
+
+# "index_then_average": SPI for every grid cell, then the area mean of the SPI values
+# "average_then_index": area-mean precipitation per region, then one SPI fit per region
+AGGREGATION_ORDERS = ("index_then_average", "average_then_index")
+
+# Same bound as xclim: the largest |SPI| a float64 probability can be mapped to
+SPI_LIMIT = 8.21
 
 
 def extract_precipitation_mm_per_day(ds: xr.Dataset) -> xr.DataArray:
@@ -23,6 +54,196 @@ def extract_precipitation_mm_per_day(ds: xr.Dataset) -> xr.DataArray:
     return pr
 
 
+def fit_zero_inflated_gamma(samples: np.ndarray) -> tuple:
+    """
+    Fit a zero-inflated gamma distribution (loc fixed at 0) to every series of a stacked array at once.
+    The shape is Thom's (1958) closed-form approximation of the maximum likelihood estimate, i.e. the
+    same estimator as xclim's method="APP" with fitkwargs={"floc": 0}; zeros only enter the probability of zero.
+
+    Parameters:
+        samples: np.ndarray, (..., n) calibration samples, NaN for missing values
+
+    Returns:
+        (alpha, beta, prob_zero): np.ndarrays of shape (...), gamma shape, gamma scale and probability of zero
+    """
+    valid = ~np.isnan(samples)
+    positive = valid & (samples > 0)
+    n_valid = valid.sum(axis=-1)
+    n_positive = positive.sum(axis=-1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(positive, samples, 0.0).sum(axis=-1) / n_positive
+        mean_of_logs = np.where(positive, np.log(np.where(positive, samples, 1.0)), 0.0).sum(axis=-1) / n_positive
+        a = np.log(mean) - mean_of_logs
+        alpha = (1 + np.sqrt(1 + 4 * a / 3)) / (4 * a)
+        beta = mean / alpha
+        prob_zero = (n_valid - n_positive) / n_valid
+
+    return alpha, beta, prob_zero
+
+
+def gamma_to_spi(values: np.ndarray, alpha: np.ndarray, beta: np.ndarray, prob_zero: np.ndarray) -> np.ndarray:
+    """
+    Map precipitation to SPI through the fitted zero-inflated gamma CDF and the standard normal quantile function.
+    Parameters broadcast against values; the result is clipped to ±SPI_LIMIT like xclim.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cdf = gammainc(alpha, np.where(values > 0, values, 0.0) / beta)
+        probs = np.where(values > 0, prob_zero + (1 - prob_zero) * cdf, prob_zero)
+        spi = np.clip(ndtri(probs), -SPI_LIMIT, SPI_LIMIT)
+    return np.where(np.isnan(values), np.nan, spi)
+
+
+# Names of the fitted zero-inflated gamma parameters, each stored as a (series, 12 calendar months) array
+GAMMA_PARAMS = ("alpha", "beta", "prob_zero")
+
+
+def fit_spi_params(totals: np.ndarray, months: np.ndarray, calibration: np.ndarray) -> dict:
+    """
+    Fit the zero-inflated gamma distribution of every series and calendar month on the calibration years.
+
+    Parameters:
+        totals: np.ndarray, (series, time) monthly precipitation (totals or mean rates)
+        months: np.ndarray, (time,) calendar month (1-12) of each time step
+        calibration: np.ndarray, (time,) boolean mask of the calibration period
+
+    Returns:
+        dict: {"alpha", "beta", "prob_zero"}, each np.ndarray of shape (series, 12)
+    """
+    params = {name: np.full((totals.shape[0], 12), np.nan) for name in GAMMA_PARAMS}
+    for month in range(1, 13):
+        in_month = months == month
+        if not in_month.any():
+            continue
+        fitted = fit_zero_inflated_gamma(totals[:, in_month & calibration])
+        for name, values in zip(GAMMA_PARAMS, fitted):
+            params[name][:, month - 1] = values
+    return params
+
+
+def apply_spi_params(totals: np.ndarray, months: np.ndarray, params: dict) -> np.ndarray:
+    """
+    Map monthly series to SPI with parameters from fit_spi_params.
+
+    Returns:
+        np.ndarray, (series, time) SPI values
+    """
+    index = months - 1
+    return gamma_to_spi(totals, *(params[name][:, index] for name in GAMMA_PARAMS))
+
+
+def compute_spi_batch(totals: np.ndarray, months: np.ndarray, calibration: np.ndarray) -> np.ndarray:
+    """
+    Compute SPI for many monthly series at once: for each calendar month, the gamma distribution
+    of every series is fitted on the calibration years in one vectorised call.
+
+    Parameters:
+        totals: np.ndarray, (series, time) monthly precipitation (totals or mean rates)
+        months: np.ndarray, (time,) calendar month (1-12) of each time step
+        calibration: np.ndarray, (time,) boolean mask of the calibration period
+
+    Returns:
+        np.ndarray, (series, time) SPI values
+    """
+    return apply_spi_params(totals, months, fit_spi_params(totals, months, calibration))
+
+
+def compute_spi_numpy(pr: xr.DataArray, cal_start: str, cal_end: str, freq: str = "MS",
+                      windows=(1,), param_path: str = None, refit: bool = False) -> xr.DataArray:
+    """
+    Compute SPI for every series of a DataArray (any dims besides time) with the batched gamma fit.
+    All accumulation windows are derived from one cumulative sum of the monthly series.
+    With a param_path, fitted parameters are reused from disk (see paramStore) and only missing
+    windows are fitted; refit=True ignores the stored parameters and overwrites them.
+
+    Parameters:
+        pr: xarray.DataArray, daily precipitation in mm/day, or monthly totals if freq is None
+        cal_start, cal_end: str, calibration period
+        freq: str, resampling frequency of daily input, or None if pr is already monthly
+        windows: iterable of int, accumulation windows in months
+        param_path: str, parameter file of this fit (see paramStore.get_param_path), or None to always fit
+        refit: bool, fit again even if stored parameters exist
+
+    Returns:
+        xarray.DataArray of SPI with dims ("window", *monthly input dims)
+    """
+    if freq is not None:
+        pr = pr.resample(time=freq).mean()
+    pr = pr.transpose("time", ...)
+
+    calibration = np.zeros(pr.sizes["time"], dtype=bool)
+    calibration[pr.get_index("time").slice_indexer(cal_start, cal_end)] = True
+    months = pr.time.dt.month.values
+
+    windows = list(windows)
+    totals = rolling_window_means(pr.values.reshape(pr.sizes["time"], -1).T, windows)
+    params = load_or_fit_window_params(
+        param_path,
+        compute_series_key(*(pr[dim].values for dim in pr.dims if dim != "time")),
+        windows,
+        GAMMA_PARAMS,
+        lambda window: fit_spi_params(totals[window], months, calibration),
+        refit=refit,
+        cal_start=cal_start, cal_end=cal_end, dist="gamma",
+    )
+    spi = [apply_spi_params(totals[window], months, params[window]).T.reshape(pr.shape) for window in windows]
+
+    return xr.DataArray(
+        np.stack(spi), coords={**pr.coords, WINDOW_DIM: windows}, dims=(WINDOW_DIM, *pr.dims), name="SPI"
+    )
+
+
+def compute_spi_xclim(pr: xr.DataArray, cal_start: str, cal_end: str, freq: str = "MS",
+                      windows=(1,)) -> xr.DataArray:
+    """
+    Compute SPI with xclim (gamma, approximate MLE, loc fixed at 0), one call per accumulation window.
+
+    Returns:
+        xarray.DataArray of SPI with dims ("window", *monthly input dims)
+    """
+    # SPI fits along the whole time axis, so a dask-backed series must be a single time chunk
+    if pr.chunks is not None:
+        pr = pr.chunk({"time": -1})
+
+    windows = list(windows)
+    spi = [
+        standardized_precipitation_index(
+            pr,
+            freq=freq,
+            window=window,
+            dist="gamma",
+            method="APP",
+            cal_start=cal_start,
+            cal_end=cal_end,
+            fitkwargs={"floc": 0},
+        )
+        for window in windows
+    ]
+    return xr.concat(spi, dim=xr.DataArray(windows, dims=WINDOW_DIM, name=WINDOW_DIM))
+
+
+def compute_spi_grid(pr: xr.DataArray, cal_start: str, cal_end: str, freq: str = "MS",
+                     engine: str = "numpy", windows=(1,), param_path: str = None, refit: bool = False) -> xr.DataArray:
+    """
+    Compute SPI for every series of pr and every accumulation window with the selected engine (see SPI_ENGINES).
+    Stored parameters (param_path/refit) are used by the numpy engine; the xclim engine is the
+    reference path and always fits from scratch.
+    """
+    if engine == "numpy":
+        return compute_spi_numpy(pr, cal_start, cal_end, freq, windows, param_path, refit)
+    if engine == "xclim":
+        return compute_spi_xclim(pr, cal_start, cal_end, freq, windows)
+    raise ValueError(f"Unknown SPI engine '{engine}', expected one of {SPI_ENGINES}")
+
+
+def check_aggregation_order(aggregation: str):
+    """
+    Raise a ValueError for an unknown aggregation order (see AGGREGATION_ORDERS).
+    """
+    if aggregation not in AGGREGATION_ORDERS:
+        raise ValueError(f"Unknown aggregation order '{aggregation}', expected one of {AGGREGATION_ORDERS}")
+
+
 def compute_spi_for_region(
         model_family: str,
         scenario: str,
@@ -31,37 +252,49 @@ def compute_spi_for_region(
         region_id: int,
         region_name: str,
         cal_start: str = "1976-01-01",
-        cal_end: str = "2005-12-31"
+        cal_end: str = "2005-12-31",
+        freq: str = "MS",
+        engine: str = "numpy",
+        aggregation: str = "index_then_average",
+        windows=DEFAULT_WINDOWS,
+        param_path: str = None,
+        refit: bool = False
 ) -> pd.DataFrame:
     """
     Compute SPI time series for a specific region using its precipitation data.
 
     Parameters:
-        pr_region: xarray.DataArray, precipitation data of the region in mm/day
+        pr_region: xarray.DataArray, precipitation data of the region in mm/day, or monthly totals in mm/month
         region_id: int, region's NRM_ID
         region_name: str, name of the region
         cal_start: str, start of calibration period
         cal_end: str, end of calibration period
+        freq: str, resampling frequency of daily input, or None if pr_region is already monthly
+        engine: str, "numpy" (batched gamma fit) or "xclim"
+        aggregation: str, "index_then_average" averages the SPI of every grid cell,
+                     "average_then_index" fits one distribution to the area-mean precipitation
+        windows: iterable of int, accumulation windows in months
+        param_path: str, file of the fitted parameters to reuse/store (see paramStore.get_param_path)
+        refit: bool, fit again even if stored parameters exist
 
     Returns:
-        pd.DataFrame containing columns: time, SPI, region_id, region_name
+        pd.DataFrame containing columns: time, SPI (1 month), SPI_<window> for longer windows, region_id, region_name
         :param model_name:
     """
+    check_aggregation_order(aggregation)
     try:
-        spi = standardized_precipitation_index(
-            pr_region,
-            freq="MS",
-            window=1,
-            dist="gamma",
-            method="APP",
-            cal_start=cal_start,
-            cal_end=cal_end,
-            fitkwargs={"floc": 0},
-        )
-
-        spi_mean_ts = spi.mean(dim=["lat", "lon"], skipna=True)
+        if aggregation == "average_then_index":
+            # cos(lat)-weighted like the all-region export (NRM.aggregate_region_means)
+            pr_mean_ts = weighted_region_mean(pr_region)
+            spi_mean_ts = compute_spi_grid(pr_mean_ts, cal_start, cal_end, freq, engine, windows, param_path, refit)
+        else:
+            spi = compute_spi_grid(pr_region, cal_start, cal_end, freq, engine, windows, param_path, refit)
+            spi_mean_ts = weighted_region_mean(spi)
 
-        df = spi_mean_ts.to_dataframe(name="SPI").reset_index()
+        df = merge_window_frames({
+            int(window): spi_mean_ts.sel({WINDOW_DIM: window}, drop=True).to_dataframe(name="SPI").reset_index()
+            for window in spi_mean_ts[WINDOW_DIM].values
+        }, "SPI")
         df["time"] = pd.to_datetime(df["time"].astype(str), errors="coerce")
         df["time"] = df["time"].dt.strftime("%Y-%m")
         df["region_id"] = region_id
@@ -77,45 +310,107 @@ def compute_spi_for_region(
         return pd.DataFrame(columns=["time", "SPI", "region_id", "region_name"])
 
 
-def export_all_regions_spi_to_csv(region_dict, model_family, scenario, model_name, variable, cal_start, cal_end):
+def export_all_regions_spi_to_csv(pr, label_grid, model_family, scenario, model_name, variable, cal_start, cal_end,
+                                  freq="MS", engine="numpy", aggregation="index_then_average",
+                                  windows=DEFAULT_WINDOWS, output_dir=None, param_path=None, refit=False):
     """
     Compute SPI for all regions and export the results to a single CSV file.
+    With "index_then_average", SPI is computed once for every cell that belongs to a region, then all
+    region means are taken in a single pass with NRM.aggregate_region_means. With "average_then_index",
+    the precipitation is averaged per region first and SPI is fitted once per region series.
+    Every accumulation window becomes its own column: SPI (1 month), SPI_3, SPI_6, ...
 
     Parameters:
-        region_dict: dict, containing region_id → {name, data}
+        pr: xarray.DataArray, gridded precipitation in mm/day, or monthly totals in mm/month
+        label_grid: xarray.Dataset, region label grid of pr's lat/lon (see NRM.load_region_label_grid)
         model_family: str, e.g., CMIP5 or CMIP6
         scenario: str, e.g., rcp45 or rcp85
         variable: str, e.g., pr
         cal_start: str, calibration period start
         cal_end: str, calibration period end
+        freq: str, resampling frequency of daily input, or None for monthly input
+        engine: str, "numpy" (batched gamma fit) or "xclim"
+        aggregation: str, "index_then_average" or "average_then_index"
+        windows: iterable of int, accumulation windows in months
+        output_dir: str, folder of the CSV file, defaults to the current directory
+        param_path: str, file of the fitted parameters to reuse/store (see paramStore.get_param_path)
+        refit: bool, fit again even if stored parameters exist
 
     """
-    all_spi_dfs = []
-    print("🌏 Starting SPI computation for all regions...")
+    check_aggregation_order(aggregation)
+    print(f"🌏 Starting SPI computation for all regions... [engine={engine}, aggregation={aggregation}]")
 
-    for region_id, info in region_dict.items():
-        region_name = info["name"]
-        pr_region = info["data"]
-        print(f"📍 Processing region: {region_id} - {region_name}")
-        df_spi = compute_spi_for_region(model_family, scenario,model_name, pr_region, region_id, region_name, cal_start, cal_end)
-        all_spi_dfs.append(df_spi)
+    window = get_labelled_window(label_grid)
+    pr = pr.isel(window)
+    label_grid = label_grid.isel(window)
 
-    all_spi_df = pd.concat(all_spi_dfs, ignore_index=True)
+    if aggregation == "average_then_index":
+        pr_regions = aggregate_region_means(pr, label_grid).compute()
+        spi_regions = compute_spi_grid(pr_regions, cal_start, cal_end, freq, engine, windows, param_path, refit)
+    else:
+        spi = compute_spi_grid(pr, cal_start, cal_end, freq, engine, windows, param_path, refit)
+        spi_regions = aggregate_region_means(spi, label_grid).compute()
+    spi_regions = spi_regions.dropna("region", how="all")
+
+    all_spi_df = merge_window_frames({
+        int(window): region_means_to_dataframe(
+            spi_regions.sel({WINDOW_DIM: window}, drop=True), "SPI",
+            model_family=model_family, scenario=scenario, model_name=model_name
+        )
+        for window in spi_regions[WINDOW_DIM].values
+    }, "SPI")
     output_path = f"all_regions_spi_{model_family}_{scenario}_{variable}_{model_name}.csv"
+    if output_dir is not None:
+        output_path = os.path.join(output_dir, output_path)
     all_spi_df.to_csv(output_path, index=False)
 
     print(f"[✅] All region SPI results saved to: {output_path}")
-    print(f"[📊] Successfully computed SPI for {all_spi_df['region_id'].nunique()} out of {len(region_dict)} regions.")
+    print(f"[📊] Successfully computed SPI for {all_spi_df['region_id'].nunique()} out of {label_grid.sizes['region']} regions.")
 
 
-def compute_spi(model_family, scenario, model_name, variable, cal_start, cal_end):
-    ds = load_data(model_family, scenario, variable, model_name)
-    pr = extract_precipitation_mm_per_day(ds)
+def compute_spi(model_family, scenario, model_name, variable, cal_start, cal_end, use_monthly=True,
+                engine="numpy", aggregation="index_then_average", windows=DEFAULT_WINDOWS,
+                output_dir=None, cache_params=True, refit=False):
+    """
+    Compute SPI for all NRM regions of one model/scenario and export it to CSV.
+
+    Parameters:
+        use_monthly: bool, if True read the persisted monthly totals (see readNcFiles.load_monthly_data)
+                     instead of summing the daily data to the same totals on every run
+        engine: str, "numpy" (batched gamma fit) or "xclim"
+        aggregation: str, "index_then_average" (per-cell SPI, then region means) or
+                     "average_then_index" (region-mean precipitation, then one SPI per region)
+        windows: iterable of int, accumulation windows in months, stored as SPI, SPI_3, SPI_6, ...
+        output_dir: str, folder of the CSV file, defaults to the current directory
+        cache_params: bool, reuse the distribution parameters fitted on the calibration period by earlier runs
+                      (backend/data/index_params), so only the cheap transform is redone
+        refit: bool, fit again and overwrite the stored parameters
+    """
+    if use_monthly:
+        pr = load_monthly_data(model_family, scenario, variable, model_name)[variable]
+    else:
+        # summed to the same mm/month totals as the monthly store (like SPEI's daily path): a mean of the
+        # daily rates weights months by their length differently once windows span several months
+        ds = load_data(model_family, scenario, variable, model_name, lazy=True)
+        pr = sum_to_monthly(extract_precipitation_mm_per_day(ds))
+        pr.attrs["units"] = "mm/month"
+    freq = None
 
     shapefile_path = get_shapefile_path()
-    region_dict = extract_regions_from_shapefile(shapefile_path, pr)
+    label_grid = load_region_label_grid(shapefile_path, pr.lat.values, pr.lon.values)
+
+    param_path = None
+    if cache_params and engine == "numpy":
+        param_path = get_param_path(
+            "spi", model_family, scenario, model_name, variable,
+            cal_start=cal_start, cal_end=cal_end, engine=engine, aggregation=aggregation,
+            # parameters fitted on the mean daily rates of earlier runs are not reused for the daily totals
+            source="monthly" if use_monthly else "daily_totals",
+            source_fingerprint=get_source_fingerprint(model_family, scenario, variable, model_name),
+        )
 
-    export_all_regions_spi_to_csv(region_dict, model_family, scenario, model_name, variable, cal_start, cal_end)
+    export_all_regions_spi_to_csv(pr, label_grid, model_family, scenario, model_name, variable, cal_start, cal_end, freq,
+                                  engine, aggregation, windows, output_dir, param_path, refit)
 
 
 if __name__ == "__main__":